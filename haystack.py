@@ -6,20 +6,74 @@ image (include the extension.)
 
 The file pi_hex_1b.txt, or pi_hex_1b.zip, as downloaded from
 https://archive.org/details/pi_hex_1b is required in the same directory.
+The first time, the digits are converted to bytes and saved as pi_hex_1b.bin,
+which is used directly afterwards (and by pifind.py and verify.py).
 """
-import io
 import os
 import sys
+import mmap
 import argparse
 from math import sqrt
 from zipfile import ZipFile
-from itertools import chain, product
+from itertools import product
 from PIL import Image
 
 HEXFILE = 'pi_hex_1b.txt'
 ZIPFILE = 'pi_hex_1b.zip'
+BINFILE = 'pi_hex_1b.bin'
 HEXDIGS = 100_000_000
 
+def open_pi_bytes():
+    """Memory-map BINFILE, holding the bytes of π's hex digits after the '3.'.
+    If it doesn't exist yet, first create it from HEXFILE or ZIPFILE.
+    Return None if none of these files are present.
+    """
+    if not os.path.exists(BINFILE):
+        if os.path.exists(HEXFILE):
+            fid = open(HEXFILE, 'rb')
+        elif os.path.exists(ZIPFILE):
+            fid = ZipFile(ZIPFILE).open(HEXFILE)
+        else:
+            return None
+        print(f'Saving the digits of π as bytes in {BINFILE}. This only happens once.')
+        with fid, open(BINFILE + '.part', 'wb') as out:
+            fid.read(2) # skip '3.'
+            for data in iter(lambda: fid.read(10_000_000), b''):
+                out.write(bytes.fromhex(data.decode('ascii')))
+        os.replace(BINFILE + '.part', BINFILE)
+    with open(BINFILE, 'rb') as fid:
+        return mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+
+def pibytes_at(mm, index, count, numread=1<<20):
+    """Get count bytes of π from mm, starting at the given hex digit index
+    (0 is the first digit after the point.)
+    At odd indices, the bytes are shifted by a nibble numread bytes at a time,
+    into a preallocated bytearray, rather than going through hex for all of them.
+    """
+    start = index // 2
+    if index % 2 == 0:
+        return mm[start:start+count]
+    buf = bytearray(count)
+    for pos in range(0, count, numread):
+        chunk = mm[start+pos:start+min(pos+numread, count)+1]
+        buf[pos:pos+numread] = bytes.fromhex(chunk.hex()[1:-1])
+    return buf
+
+def findodd(mm, byts, end):
+    """Find the first odd hex digit index where byts appears in π, within the
+    first end bytes of mm, or return -1.
+    At odd alignments, all but the first and last digits of byts are whole bytes
+    of mm, so search for those and check the nibbles on either side.
+    """
+    inner = bytes.fromhex(byts.hex()[1:-1])
+    head, tail = byts[0] >> 4, byts[-1] & 0xf
+    pos = mm.find(inner, 1, end - 1)
+    while pos > 0:
+        if mm[pos-1] & 0xf == head and mm[pos+len(inner)] >> 4 == tail:
+            return 2*pos - 1
+        pos = mm.find(inner, pos + 1, end - 1)
+    return -1
+
 def valid_image(name):
     """Open the given filename as an image.
     Convert exceptions to ArgumentTypeError for use with argparse.
@@ -44,17 +98,8 @@ args = parser.parse_args()
 if not check_ext(args.newname):
     sys.exit(f'"{args.newname}" does not end in a recognized image extension')
 
-if os.path.exists(HEXFILE):
-    with open(HEXFILE) as fid:
-        fid.read(2)
-        pihex = fid.read(HEXDIGS)
-elif os.path.exists(ZIPFILE):
-    with ZipFile(ZIPFILE) as zf:
-        with zf.open(HEXFILE) as fid:
-            fid = io.TextIOWrapper(fid, encoding='ascii')
-            fid.read(2)
-            pihex = fid.read(HEXDIGS)
-else:
+pimap = open_pi_bytes()
+if pimap is None:
     sys.exit(f'Either {HEXFILE} or {ZIPFILE} must be provided in the working directory.')
 
 target = args.original
@@ -65,7 +110,6 @@ numpix = width*height
 palette = target.getpalette()
 palette = list(zip(palette[::3], palette[1::3], palette[2::3]))
 imgbytes = target.tobytes()
-imghex = imgbytes.hex()
 
 # Some of the palette entries may be unused.
 # This results in a monotonous haystack with less variety of color than otherwise.
@@ -89,36 +133,48 @@ else:
     for byt, col in zip(unused, websafe):
         palette[byt] = col
 
-try:
-    index = pihex.index(imghex)
-except ValueError:
+# index is the first hex digit where imgbytes appears, at either alignment.
+# An odd-aligned match only matters if it comes before the even-aligned one,
+# so the odd search stops there and the digits are only scanned through once.
+evenpos = pimap.find(imgbytes, 0, HEXDIGS//2)
+oddend = evenpos + numpix if evenpos >= 0 else HEXDIGS//2
+index = findodd(pimap, imgbytes, oddend)
+if index < 0:
+    index = 2*evenpos
+if index < 0:
     sys.exit(f'Could not find image bytes within first {HEXDIGS} hex digits of π!')
 
-# We want to cut pihex so that an exact multiple of 2*numpix shows up before index,
+# We want to cut the digits so that an exact multiple of 2*numpix shows up before index,
 # and after, too.
 numhex = 2*numpix
 offset = index % numhex
 maxcopy = (HEXDIGS - offset) // numhex
-pibytes = bytes.fromhex(pihex[offset:maxcopy*numhex+offset])
+numbytes = maxcopy*numpix
+if offset % 2 == 0: # the bytes can be copied straight out of the file
+    pibytes, base = pimap, offset // 2
+else:
+    pibytes, base = pibytes_at(pimap, offset, numbytes), 0
 
-cols = round(sqrt(len(pibytes)) / width)
-rows = round(len(pibytes) / (cols*width)) // height
+cols = round(sqrt(numbytes) / width)
+rows = round(numbytes / (cols*width)) // height
+tilerow = cols*numpix # bytes in one row of tiles
+rows = min(rows, numbytes // tilerow)
 haysize = (cols*width, rows*height)
 
-# break pibytes into chunks of size numpix
-tiles = [pibytes[numpix*i:numpix*(i+1)] for i in range(rows*cols)]
-# break each tile into rows of target width
-tiles = [[t[width*i:width*(i+1)] for i in range(height)] for t in tiles]
-
-haydata = []
-
-for r in range(rows):
-    rowtiles = tiles[cols*r:cols*(r+1)]
+# pibytes is a sequence of tiles, each numpix bytes long, but the haystack has
+# a row of cols tiles side by side: row h of each tile comes before row h+1 of any.
+# A byte's position within its row of tiles only depends on its position within
+# its tile, so each of those is copied for every row of tiles at once, by stepping
+# through both buffers tilerow bytes at a time.
+haydata = bytearray(rows*tilerow)
+end = base + rows*tilerow
+for c in range(cols):
     for h in range(height):
-        for c in range(cols):
-            haydata.extend(rowtiles[c][h])
+        for w in range(width):
+            src = base + c*numpix + h*width + w
+            dst = h*cols*width + c*width + w
+            haydata[dst::tilerow] = pibytes[src:end:tilerow]
 
-haystack = Image.new('P', haysize)
-haystack.putpalette(chain(*palette))
-haystack.putdata(haydata)
+haystack = Image.frombuffer('P', haysize, haydata, 'raw', 'P', 0, 1)
+haystack.putpalette(b''.join(map(bytes, palette)))
 haystack.save(args.newname)
@@ -8,7 +8,7 @@ attempting to make it look like the original.
 import json
 import argparse
 from urllib import request
-from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 from collections import Counter
 from PIL import Image
 
@@ -16,30 +16,44 @@ def getcontent(url):
     with request.urlopen(url) as req:
         return json.load(req)['content']
 
-def getpihex(start, number):
+def getpihex(start, number, workers=16):
+    """Fetch number hex digits of π from pi.delivery, starting at start.
+    The API gives at most 1000 digits per request, so fetch the 1000-digit
+    pieces concurrently, with the given number of threads.
+    """
     base = 'https://api.pi.delivery/v1/pi'
-    result = ''
-    while number:
-        fetch = min(number, 1000)
-        url = f'{base}?start={start}&numberOfDigits={fetch}&radix=16'
-        hexits = getcontent(url)
-        result += hexits
-        number -= len(hexits)
-        start += len(hexits)
+    end = start + number
+    def getpiece(start):
+        stop = min(start + 1000, end)
+        result = ''
+        while start < stop: # keep asking if the API returns fewer digits than requested
+            hexits = getcontent(f'{base}?start={start}&numberOfDigits={stop - start}&radix=16')
+            if not hexits:
+                raise ValueError(f'pi.delivery returned no digits at {start}')
+            result += hexits
+            start += len(hexits)
+        return result
+    with ThreadPoolExecutor(workers) as pool:
+        result = ''.join(pool.map(getpiece, range(start, end, 1000)))
+    if len(result) != number:
+        raise ValueError(f'Expected {number} digits from pi.delivery, but got {len(result)}')
     return result
 
-def colavg(wts):
-    """Given a dictionary of RGB triples : counts, return an averaged color."""
-    R = G = B = 0
-    totct = 0
-    for (cr, cg, cb), num in wts.items():
-        R += cr*num
-        G += cg*num
-        B += cb*num
-        totct += num
-    if not totct:
-        return (0, 0, 0)
-    return (round(R/totct), round(G/totct), round(B/totct))
+def makepalette(pixbytes, colors):
+    """Create a palette (list of 256 RGB triples) mapping each byte to the weighted
+    average of its colors.
+    """
+    R = [0]*256
+    G = [0]*256
+    B = [0]*256
+    totct = [0]*256
+    for (byt, (cr, cg, cb)), num in Counter(zip(pixbytes, colors)).items():
+        R[byt] += cr*num
+        G[byt] += cg*num
+        B[byt] += cb*num
+        totct[byt] += num
+    return [(round(r/n), round(g/n), round(b/n)) if n else (0, 0, 0)
+            for r, g, b, n in zip(R, G, B, totct)]
 
 def valid_image(name):
     """Open the given filename as an image.
@@ -72,12 +86,8 @@ colors = list(target.getdata())
 pihexits = getpihex(args.start, numpix*2)
 pixbytes = bytes.fromhex(pihexits)
 
-bytarr = [Counter() for _ in range(256)]
-for byt, col in zip(pixbytes, colors):
-    bytarr[byt][col] += 1
-palette = [colavg(b) for b in bytarr]
+palette = makepalette(pixbytes, colors)
 
-img = Image.new('P', target.size)
-img.putpalette(chain(*palette))
-img.putdata(pixbytes)
+img = Image.frombuffer('P', target.size, pixbytes, 'raw', 'P', 0, 1)
+img.putpalette(b''.join(map(bytes, palette)))
 img.save(args.out)
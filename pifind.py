@@ -8,6 +8,8 @@ If the file pi_hex_1b.txt, or pi_hex_1b.zip, as downloaded from
 https://archive.org/details/pi_hex_1b is present in the same directory,
 it will be used as a source of hexadecimal digits from π. Otherwise, digits
 will be fetched from the API provided by Google at https://pi.delivery.
+The first time, the digits are converted to bytes and saved as pi_hex_1b.bin,
+which is used directly afterwards (and by haystack.py and verify.py).
 
 In the case of using the online service, it will continue until stopped
 (e.g. Ctrl-C) because there are 50 trillion digits available.
@@ -19,13 +21,18 @@ The best image found so far is saved as found.gif.
 """
 import os
 import sys
+import mmap
 import signal
-from itertools import chain
+import threading
+from queue import Queue
+from operator import eq, itemgetter
+from itertools import compress
 from collections import Counter, deque
 from PIL import Image
 
 HEXFILE = 'pi_hex_1b.txt'
 ZIPFILE = 'pi_hex_1b.zip'
+BINFILE = 'pi_hex_1b.bin'
 
 def PiFileReader(fid, numread=10_000_000):
     """Given a file-like object, containing text hexadecimal digits,
@@ -45,20 +52,76 @@ def PiZipFileReader(filename):
     fid = zf.open(HEXFILE)
     yield from PiFileReader(fid)
 
-def PiDelivery(numread=1000): # 1000 is the max digits supported per request
+def prefetch(gen, depth=2):
+    """Run the generator gen in a background thread, yielding its items in turn,
+    with up to depth more read ahead while the caller works on the current one.
+    """
+    queue = Queue(maxsize=depth)
+    def fill():
+        try:
+            for item in gen:
+                queue.put((True, item))
+        except BaseException as e:
+            queue.put((False, e))
+        else:
+            queue.put((False, None))
+    threading.Thread(target=fill, daemon=True).start()
+    while True:
+        more, item = queue.get()
+        if not more:
+            if item is not None:
+                raise item
+            return
+        yield item
+
+def open_pi_bytes():
+    """Memory-map BINFILE, holding the bytes of π's hex digits after the '3.'.
+    If it doesn't exist yet, first create it from HEXFILE or ZIPFILE.
+    Return None if none of these files are present.
+    """
+    if not os.path.exists(BINFILE):
+        if os.path.exists(HEXFILE):
+            hexgen = PiFileReader(open(HEXFILE, 'rb'))
+        elif os.path.exists(ZIPFILE):
+            hexgen = PiZipFileReader(ZIPFILE)
+        else:
+            return None
+        print(f'Saving the digits of π as bytes in {BINFILE}. This only happens once.')
+        with open(BINFILE + '.part', 'wb') as out:
+            for data in prefetch(hexgen):
+                out.write(bytes.fromhex(data.decode('ascii')))
+        os.replace(BINFILE + '.part', BINFILE)
+    with open(BINFILE, 'rb') as fid:
+        return mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+
+def PiBinReader(mm, numread=5_000_000):
+    """Given the memory-mapped bytes of π, yield bytes objects of numread bytes."""
+    for start in range(0, len(mm), numread):
+        yield mm[start:start+numread]
+
+def PiDelivery(numread=1000, workers=16): # 1000 is the max digits supported per request
+    """Yield bytes of π from pi.delivery, numread digits at a time.
+    Keep the given number of requests in flight at once, in background threads.
+    """
     from urllib import request
+    from concurrent.futures import ThreadPoolExecutor
     import json
     base = 'https://api.pi.delivery/v1/pi'
-    start = 1
-    while True:
+    def fetch(start):
         with request.urlopen(f'{base}?start={start}&numberOfDigits={numread}&radix=16') as req:
             j = json.load(req)
-            yield j['content'].encode()
-        start += numread
+            return bytes.fromhex(j['content'])
+    with ThreadPoolExecutor(workers) as pool:
+        pending = deque(pool.submit(fetch, 1 + i*numread) for i in range(workers))
+        start = 1 + workers*numread
+        while True:
+            yield pending.popleft().result()
+            pending.append(pool.submit(fetch, start))
+            start += numread
 
 def colhex(col):
     """RGB hex code #000000 for a color triple."""
-    return '#' + ''.join(f'{c:02X}' for c in col)
+    return '#' + bytes(col).hex().upper()
 
 def colorsummary(C, maxlist=10):
     """Summarize a Counter of RGB colors."""
@@ -74,6 +137,12 @@ def colpick(colors, col):
     """Given a list of colors, pick the one closest to col."""
     return min(colors, key=lambda c: coldist(col, c))
 
+def colpicks(colors, cols):
+    """Given a list of colors, map each distinct color in cols to the index of
+    the closest one, so colpick only runs once per color, not once per pixel.
+    """
+    return {col: colors.index(colpick(colors, col)) for col in set(cols)}
+
 def colavg(wts):
     """Given a dictionary of RGB triples : counts, return an averaged color."""
     R = G = B = 0
@@ -131,7 +200,8 @@ def reducecolors(C, numpix):
 def recolor(img, colors):
     """Create a version of img with colors limited to those given."""
     newimg = Image.new('RGB', img.size)
-    newimg.putdata([colpick(colors, c) for c in img.getdata()])
+    nearest = colpicks(colors, img.getdata())
+    newimg.putdata([colors[nearest[c]] for c in img.getdata()])
     return newimg
 
 def printpattern(pat, width, height):
@@ -139,10 +209,11 @@ def printpattern(pat, width, height):
     lines = [''.join(str(i) for i in pat[width*j:width*(j+1)]) for j in range(height)]
     print(*lines, sep='\n')
 
-if os.path.exists(HEXFILE):
-    pigen = PiFileReader(open(HEXFILE, 'rb'))
-elif os.path.exists(ZIPFILE):
-    pigen = PiZipFileReader(ZIPFILE)
+pimap = open_pi_bytes()
+if pimap is not None:
+    if hasattr(mmap, 'MADV_SEQUENTIAL'): # have the OS read ahead (Python 3.8+, not Windows)
+        pimap.madvise(mmap.MADV_SEQUENTIAL)
+    pigen = PiBinReader(pimap)
 else:
     pigen = PiDelivery()
 
@@ -179,31 +250,79 @@ else:
     colors = list(C.keys())
 
 print(f'Selected {numcol} colors for the pattern.')
-pattern = [colors.index(colpick(colors, c)) for c in target.getdata()]
+nearest = colpicks(colors, C)
+pattern = [nearest[c] for c in target.getdata()]
 colorsummary(Counter(colors[i] for i in pattern))
 print('Pattern of colors to try to match:')
 printpattern(pattern, *target.size)
 
-def dribble(gen):
+# Gathering the pixels of a window color by color puts the bytes under each color
+# of the pattern together, in the spans given.
+order = sorted(range(numpix), key=pattern.__getitem__)
+gather = itemgetter(*order)
+spans = []
+start = 0
+for i in range(numcol):
+    end = start + pattern.count(i)
+    spans.append((start, end))
+    start = end
+
+def windows(gen):
+    """Yield each index into the hex digits of π, with the numpix bytes starting there.
+    gen yields the bytes of π, made of even-aligned hex digits 3.'24','3f','6a', etc.
+    The windows at odd indices are cut from bytes constructed from odd-aligned
+    hex digits '43', 'f6', 'a8', etc.
+    """
+    data = b''
+    start = 0 # index of data[0] among the bytes of π
     for bunch in gen:
-        for digit in bunch:
-            yield digit - (48 if digit < 58 else 87)
-            # converts 0..9, a..f (ASCII 48..57, 97..102) to int
+        data += bunch
+        count = len(data) - numpix # number of windows of both alignments in data
+        if count <= 0:
+            continue
+        straddle = bytes.fromhex(data.hex()[1:-1])
+        for j in range(count):
+            yield 2*(start + j), data[j:j+numpix]
+            yield 2*(start + j) + 1, straddle[j:j+numpix]
+        data = data[count:]
+        start += count
+    if len(data) == numpix:
+        yield 2*start, data
+
+def dropfirst(runs):
+    """Drop one occurrence of each byte from each sorted run (keeping the entries
+    equal to the next one), and drop any runs left empty.
+    """
+    return [run for run in (list(compress(run, map(eq, run, run[1:]))) for run in runs) if run]
 
-def countmismatch(bytarr):
-    """Given a list of 256 lists, with # of each color, determine least mismatches.
+def countmismatch(window, cutoff=None):
+    """Given the bytes of a window, determine least mismatches.
     This is the number of pixels not matching the 'dominant' (most common) color
     for that byte.
     Also return the number of "muddled" pixels that mix every color (as a tiebreaker).
+    If there are certainly more than cutoff mismatches, stop early, and return
+    a lower bound on the mismatches instead.
     """
-    mis = 0
-    muddle = 0
-    for colcounts in bytarr:
-        totpix = sum(colcounts) # total pixels mapped by this byte
-        mis += totpix - max(colcounts) # if we use the byte to map the most frequent color,
-        # the rest are mismatches.
-        if min(colcounts): # byte needs to map all colors
-            muddle += totpix
+    gathered = bytes(gather(window))
+    segments = [gathered[a:b] for a, b in spans]
+    present = [set(seg) for seg in segments]
+    anycolor = set().union(*present)
+    # A byte under c different colors mismatches at least c-1 pixels
+    atleast = sum(map(len, present)) - len(anycolor)
+    if cutoff is not None and atleast > cutoff:
+        return atleast, numpix
+    common = set.intersection(*present) # bytes which need to map all colors
+    muddle = sum(map(window.count, common))
+    # The dominant color of a byte covers as many pixels as it has under that byte.
+    # Count them up by repeatedly dropping one occurrence of each byte from each
+    # sorted run, and counting the distinct bytes left each time.
+    # Colors with no repeated bytes drop out after the first round, unsorted.
+    dominant = len(anycolor)
+    runs = dropfirst([sorted(seg) for seg, bytset in zip(segments, present) if len(bytset) < len(seg)])
+    while runs:
+        dominant += len(set().union(*runs))
+        runs = dropfirst(runs)
+    mis = numpix - dominant
     return mis, muddle
 
 def headline():
@@ -216,17 +335,25 @@ def status(pos, minmisrpt, index, bestbytes):
     bytepreview = bestbytes[:12].hex()
     print(f'\r{pos:14,}  {index:13,}  {minmisrpt!s:16}  {bytepreview}…', end='', flush=True)
 
-def makepalette(bytarr, colors):
-    """Create a palette (list of 256 RGB triples) mapping each byte to the weighted
-    average of its colors.
-    """
-    return [colavg(dict(zip(colors, b))) for b in bytarr]
-
-def saveimg(name, size, palette, byts):
-    img = Image.new('P', size)
-    # chain flattens the list of 256 triples to an iterator of 768 values
-    img.putpalette(chain(*palette))
-    img.putdata(byts)
+def makepalette(byts):
+    """Create a palette (768 bytes) mapping each byte to the weighted average of its colors."""
+    R = [0]*256
+    G = [0]*256
+    B = [0]*256
+    totct = [0]*256
+    for (byt, p), num in Counter(zip(byts, pattern)).items():
+        cr, cg, cb = colors[p]
+        R[byt] += cr*num
+        G[byt] += cg*num
+        B[byt] += cb*num
+        totct[byt] += num
+    return bytes(round(s/n) if n else 0
+                 for r, g, b, n in zip(R, G, B, totct) for s in (r, g, b))
+
+def saveimg(name, size, byts):
+    """Save byts as a paletted image, with the palette fit to the pattern."""
+    img = Image.frombuffer('P', size, byts, 'raw', 'P', 0, 1)
+    img.putpalette(makepalette(byts))
     img.save(name)
 
 def deferinterrupt(signum, frame):
@@ -243,10 +370,30 @@ def ordinal(n):
         return f'{n:,}th'
     return f'{n:,}' + ends[min(n%10, 4)]
 
-cur = deque(maxlen=numpix)  # bytes constructed from even-aligned hex digits 3.'24','3f','6a', etc.
-other = deque(maxlen=numpix) # bytes constructed from odd-aligned hex digits '32' '43', 'f6', 'a8', etc.
-oldhalf = 3
-minmisrpt = (numpix, numpix)
+def sweep(gen):
+    """Check every window of the digits from gen, saving each new best match.
+    Keeping the loop in a function makes its variables fast locals rather than
+    module globals. Return a message about how it finished and the best index.
+    There's no skipping ahead over windows, Boyer-Moore style: shifting by a byte
+    pairs every byte with a different pixel of the pattern, so nothing about one
+    window bounds the next. Hopeless windows are cut short by the cutoff instead.
+    """
+    minmisrpt = (numpix, numpix)
+    for start, window in windows(gen):
+        pos = start + numpix*2 - 1 # the last digit of the window
+        misrpt = countmismatch(window, minmisrpt[0])
+        if misrpt < minmisrpt:
+            minmisrpt = misrpt
+            index = start
+            status(pos, minmisrpt, index, window)
+            saveimg('found.gif', target.size, window)
+            if misrpt[0] == 0:
+                return f'Success at {index}', index
+        if not pos % 5000:
+            print(f'\r{pos:14,}', end='', flush=True)
+        if deferinterrupt.nomore:
+            return 'Interrupted', index
+    return 'Finished', index
 
 signal.signal(signal.SIGINT, deferinterrupt)
 signal.signal(signal.SIGTERM, deferinterrupt)
@@ -256,32 +403,7 @@ if hasattr(signal, 'SIGQUIT'):
     signal.signal(signal.SIGQUIT, deferinterrupt)
 
 headline()
-message = 'Finished'
-for pos, halfbyte in enumerate(dribble(pigen)):
-    cur, other = other, cur
-    cur.append(oldhalf << 4 | halfbyte)
-    oldhalf = halfbyte
-    if len(cur) < numpix:
-        continue
-    bytarr = [[0]*numcol for _ in range(256)]
-    for b, p in zip(cur, pattern):
-        bytarr[b][p] += 1
-    misrpt = countmismatch(bytarr)
-    if misrpt < minmisrpt:
-        minmisrpt = misrpt
-        index = pos - numpix*2 + 1
-        bestbytes = bytes(cur)
-        status(pos, minmisrpt, index, bestbytes)
-        fitpal = makepalette(bytarr, colors)
-        saveimg('found.gif', target.size, fitpal, bestbytes)
-        if misrpt[0] == 0:
-            message = f'Success at {index}'
-            break
-    if not pos % 5000:
-        print(f'\r{pos:14,}', end='', flush=True)
-    if deferinterrupt.nomore:
-        message = 'Interrupted'
-        break
+message, index = sweep(pigen)
 print(f'\n{message}. Best result is saved as found.gif.\n'
       f'It contains the {ordinal(index+1)} through {ordinal(index+2*numpix)} hexadecimal digits of π.\n'
       f'Equivalently, the {ordinal(4*index+1)} through {ordinal(4*index+8*numpix)} bits.')
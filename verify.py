@@ -4,28 +4,81 @@ Given command line arguments <start> and <file>, open the image file and check
 if the data inside matches the hexadecimal expansion of π starting at the given
 (1-indexed) starting point. (i.e. with π beginning 3.243f6a…, starting with the digit 2
 corresponds to index 1, starting with f corresponds to index 4, etc.)
+
+If pi_hex_1b.bin (as made by pifind.py or haystack.py), pi_hex_1b.txt or
+pi_hex_1b.zip is present, the digits are read from there; otherwise they are
+fetched from https://pi.delivery.
 """
 from PIL import Image
+import os
+import mmap
 import argparse
+from zipfile import ZipFile
 from urllib import request
+from concurrent.futures import ThreadPoolExecutor
 import json
 
+HEXFILE = 'pi_hex_1b.txt'
+ZIPFILE = 'pi_hex_1b.zip'
+BINFILE = 'pi_hex_1b.bin'
+
 def getcontent(url):
     with request.urlopen(url) as req:
         return json.load(req)['content']
 
-def getpihex(start, number):
+def getpihex(start, number, workers=16):
+    """Fetch number hex digits of π from pi.delivery, starting at start.
+    The API gives at most 1000 digits per request, so fetch the 1000-digit
+    pieces concurrently, with the given number of threads.
+    """
     base = 'https://api.pi.delivery/v1/pi'
-    result = ''
-    while number:
-        fetch = min(number, 1000)
-        url = f'{base}?start={start}&numberOfDigits={fetch}&radix=16'
-        hexits = getcontent(url)
-        result += hexits
-        number -= len(hexits)
-        start += len(hexits)
+    end = start + number
+    def getpiece(start):
+        stop = min(start + 1000, end)
+        result = ''
+        while start < stop: # keep asking if the API returns fewer digits than requested
+            hexits = getcontent(f'{base}?start={start}&numberOfDigits={stop - start}&radix=16')
+            if not hexits:
+                raise ValueError(f'pi.delivery returned no digits at {start}')
+            result += hexits
+            start += len(hexits)
+        return result
+    with ThreadPoolExecutor(workers) as pool:
+        result = ''.join(pool.map(getpiece, range(start, end, 1000)))
+    if len(result) != number:
+        raise ValueError(f'Expected {number} digits from pi.delivery, but got {len(result)}')
     return result
 
+def open_pi_bytes():
+    """Memory-map BINFILE, holding the bytes of π's hex digits after the '3.'.
+    If it doesn't exist yet, first create it from HEXFILE or ZIPFILE.
+    Return None if none of these files are present.
+    """
+    if not os.path.exists(BINFILE):
+        if os.path.exists(HEXFILE):
+            fid = open(HEXFILE, 'rb')
+        elif os.path.exists(ZIPFILE):
+            fid = ZipFile(ZIPFILE).open(HEXFILE)
+        else:
+            return None
+        print(f'Saving the digits of π as bytes in {BINFILE}. This only happens once.')
+        with fid, open(BINFILE + '.part', 'wb') as out:
+            fid.read(2) # skip '3.'
+            for data in iter(lambda: fid.read(10_000_000), b''):
+                out.write(bytes.fromhex(data.decode('ascii')))
+        os.replace(BINFILE + '.part', BINFILE)
+    with open(BINFILE, 'rb') as fid:
+        return mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ)
+
+def pibytes_at(mm, index, count):
+    """Get count bytes of π from mm, starting at the given hex digit index
+    (0 is the first digit after the point.)
+    """
+    start = index // 2
+    if index % 2 == 0:
+        return mm[start:start+count]
+    return bytes.fromhex(mm[start:start+count+1].hex()[1:-1])
+
 def valid_image(name):
     """Open the given filename as an image.
     Convert exceptions to ArgumentTypeError for use with argparse.
@@ -41,10 +94,16 @@ parser = argparse.ArgumentParser(description="Verify an image contains bytes fro
 parser.add_argument('start', type=int, help='Which hexadecimal digit to start with (1=first after decimal point)')
 parser.add_argument('image', type=valid_image, help='The image to check')
 args = parser.parse_args()
+if args.start < 1:
+    parser.error('start must be at least 1 (the first digit after the decimal point)')
 
-pixdata = args.image.tobytes().hex()
-pihexits = getpihex(args.start, len(pixdata))
+pixdata = args.image.tobytes()
+pimap = open_pi_bytes()
+if pimap is not None and (args.start + 2*len(pixdata)) // 2 <= len(pimap):
+    pidata = pibytes_at(pimap, args.start - 1, len(pixdata))
+else:
+    pidata = bytes.fromhex(getpihex(args.start, 2*len(pixdata)))
 
-print(pixdata)
-print(pihexits)
-print(pixdata == pihexits)
+print(pixdata.hex())
+print(pidata.hex())
+print(pixdata == pidata)